@@ -1,14 +1,20 @@
+import asyncio
+import functools
 import streamlit as st
 import prompt_engine as pe
 import models_config as mc
 import logging
 import json
+import os
 from datetime import datetime
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Stylesheet injected on every rerun
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "styles.css")
+
 # Streamlit page configuration
 st.set_page_config(
     page_title="PromptStudio: Autonomous Prompt Engineering System",
@@ -16,21 +22,157 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+@st.cache_resource
+def load_css():
+    """Reads the app stylesheet once per process and wraps it in a <style> tag."""
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f"<style>\n{f.read()}</style>"
+
+class UncachedResult(Exception):
+    """Raised inside a st.cache_data function to hand back a failed result without caching it."""
+    def __init__(self, value):
+        super().__init__("Result contains failures and was not cached")
+        self.value = value
+
+@st.cache_resource
+def get_client(model):
+    """Builds one caching model client per model and reuses it (and its connections) across reruns."""
+    return mc.CachingClient(mc.get_model_client(model), model)
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def _cached_generate(rough_prompt, creativity_modifier, model, _creativity_level, _client=None):
+    """Cached prompt generation, keyed on the rough prompt, creativity modifier, and model."""
+    prompts = pe.generate_prompts(rough_prompt, _creativity_level, _client)
+    if any(p.get('error') for p in prompts):
+        raise UncachedResult(prompts)
+    return prompts
+
+def cached_generate(rough_prompt, creativity_level, client=None, *, model, fresh=False):
+    """Cached prompt generation; levels in the same creativity bucket share one cache entry, which `fresh` replaces."""
+    modifier = pe.creativity_modifier(creativity_level)
+    if fresh:
+        _cached_generate.clear(rough_prompt, modifier, model)
+    try:
+        return _cached_generate(rough_prompt, modifier, model, creativity_level, client)
+    except UncachedResult as e:
+        return e.value
+
+def stream_refine(prompt, output, score, client=None, *, container):
+    """Refines the best prompt, streaming the model's reply into `container` while it arrives."""
+    try:
+        with container.container():
+            st.markdown('<h2 class="sub-header">Refining the Best Prompt</h2>', unsafe_allow_html=True)
+            refined_prompt = st.write_stream(pe.stream_refine_prompt(prompt, output, score, client))
+    except Exception as e:
+        logger.error(f"Error refining prompt: {str(e)}")
+        return prompt  # Fallback to original prompt, as refine_prompt does
+    finally:
+        # The final refined prompt is shown with the results
+        container.empty()
+    refined_prompt = refined_prompt.strip() if isinstance(refined_prompt, str) else ""
+    return refined_prompt or prompt
+
+def evaluate_pipeline(rough_prompt, creativity_level, model, iterations, fresh=False):
+    """Generates, tests, and scores prompts with the shared client; `fresh` skips cache lookups and overwrites entries."""
+    client = get_client(model)
+    if fresh:
+        client = client.refreshing()
+    # The client belongs to `model`, so the model is part of every cache key
+    generate = functools.partial(cached_generate, model=model, fresh=fresh)
+    return asyncio.run(pe.evaluate_prompts(
+        rough_prompt, creativity_level, model, iterations,
+        client=client, generate=generate
+    ))
+
+@st.cache_data(persist="disk", max_entries=256, show_spinner=False)
+def _cached_evaluate(rough_prompt, creativity_level, model, iterations, _fresh=False):
+    """Cached generate/test/score run; only runs where every prompt succeeded are stored."""
+    prompts = evaluate_pipeline(rough_prompt, creativity_level, model, iterations, fresh=_fresh)
+    if any(p.get('error') for p in prompts):
+        raise UncachedResult(prompts)
+    return prompts
+
+def cached_run_studio(rough_prompt, creativity_level, model, iterations, refine_area, fresh=False):
+    """
+    Runs the pipeline, reusing evaluated prompts from the disk cache unless `fresh`.
+    
+    The refine step runs outside st.cache_data so its reply can stream into
+    `refine_area`; repeated refinements are served by the client's completion cache.
+    """
+    if fresh:
+        _cached_evaluate.clear(rough_prompt, creativity_level, model, iterations)
+    try:
+        prompts = _cached_evaluate(rough_prompt, creativity_level, model, iterations, _fresh=fresh)
+    except UncachedResult as e:
+        prompts = e.value
+    client = get_client(model)
+    if fresh:
+        client = client.refreshing()
+    return pe.finish_studio(rough_prompt, prompts, client, functools.partial(stream_refine, container=refine_area))
+
+@st.fragment
+def render_controls():
+    """Renders the sidebar controls; changing them reruns only this fragment."""
+    st.markdown('<h2 class="sub-header">PromptStudio Controls</h2>', unsafe_allow_html=True)
+    st.selectbox(
+        "Select OpenRouter Model",
+        list(mc.MODEL_CONFIG.keys()),
+        help="Choose the model to test prompts.",
+        key="model_choice"
+    )
+    st.slider(
+        "Creativity Level", 1, 10, 5, help="Higher values produce more novel prompts.", key="creativity_level"
+    )
+    st.slider(
+        "Test Iterations", 1, 3, 1, help="Number of test runs per prompt (limited for free tier).", key="test_iterations"
+    )
+    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
+    st.info("Enter a rough prompt idea, and PromptStudio will generate, test, score, refine, and document multiple versions.")
+    st.markdown('</div>', unsafe_allow_html=True)
+
+@st.fragment
+def render_results():
+    """Renders the latest PromptStudio results, isolated from unrelated widget reruns."""
+    if not st.session_state.get('results'):
+        return
+    results = st.session_state['results']
+
+    # Generated Prompts
+    st.markdown('<h2 class="sub-header">Generated Prompts</h2>', unsafe_allow_html=True)
+    for prompt_data in results['prompts']:
+        st.markdown(f'<h3>Prompt {prompt_data["id"]} ({prompt_data["style"]})</h3>', unsafe_allow_html=True)
+        st.markdown('<div class="result-box">', unsafe_allow_html=True)
+        st.write(prompt_data["prompt"])
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # Test Results and Scores
+    st.markdown('<h2 class="sub-header">Test Results and Scores</h2>', unsafe_allow_html=True)
+    for prompt_data in results['prompts']:
+        st.markdown(f'<h3>Prompt {prompt_data["id"]} ({prompt_data["style"]}) - Score: {prompt_data["score"]}/100</h3>', unsafe_allow_html=True)
+        st.markdown('<div class="result-box">', unsafe_allow_html=True)
+        st.write(f"Test Output:\n{prompt_data['output']}")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # Refined Prompt
+    st.markdown('<h2 class="sub-header">Refined Prompt</h2>', unsafe_allow_html=True)
+    st.markdown('<div class="result-box">', unsafe_allow_html=True)
+    st.write(results['refined_prompt'])
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Download Report
+    report_text = results['report']
+    st.download_button(
+        label="Download Report",
+        data=report_text,
+        file_name=f"promptstudio_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+        mime="text/plain",
+        key="download_button"
+    )
+
 def main():
     """Main function to run the PromptStudio Streamlit app."""
     # Custom CSS for Tailwind-like styling
-    st.markdown("""
-        <style>
-        @import url('https://cdnjs.cloudflare.com/ajax/libs/tailwindcss/2.2.19/tailwind.min.css');
-        .main-header { @apply text-4xl font-bold text-gray-800 mb-6; }
-        .sub-header { @apply text-2xl font-semibold text-gray-700 mb-4; }
-        .card { @apply bg-white p-6 rounded-lg shadow-md mb-4; }
-        .button { @apply bg-purple-500 text-white px-4 py-2 rounded hover:bg-purple-600; }
-        .input-box { @apply border border-gray-300 p-2 rounded w-full mb-4; }
-        .sidebar-section { @apply mb-6; }
-        .result-box { @apply bg-gray-100 p-4 rounded-lg mb-4; }
-        </style>
-    """, unsafe_allow_html=True)
+    st.markdown(load_css(), unsafe_allow_html=True)
 
     # Validate API key
     try:
@@ -49,21 +191,10 @@ def main():
 
     # Sidebar
     with st.sidebar:
-        st.markdown('<h2 class="sub-header">PromptStudio Controls</h2>', unsafe_allow_html=True)
-        model_choice = st.selectbox(
-            "Select OpenRouter Model",
-            list(mc.MODEL_CONFIG.keys()),
-            help="Choose the model to test prompts."
-        )
-        creativity_level = st.slider(
-            "Creativity Level", 1, 10, 5, help="Higher values produce more novel prompts."
-        )
-        test_iterations = st.slider(
-            "Test Iterations", 1, 3, 1, help="Number of test runs per prompt (limited for free tier)."
-        )
-        st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
-        st.info("Enter a rough prompt idea, and PromptStudio will generate, test, score, refine, and document multiple versions.")
-        st.markdown('</div>', unsafe_allow_html=True)
+        render_controls()
+    model_choice = st.session_state['model_choice']
+    creativity_level = st.session_state['creativity_level']
+    test_iterations = st.session_state['test_iterations']
 
     # Main content
     st.markdown('<h1 class="main-header">PromptStudio: Autonomous Prompt Engineering System</h1>', unsafe_allow_html=True)
@@ -71,6 +202,8 @@ def main():
 
     # Input section
     col1, col2 = st.columns([3, 1])
+    # Below the input row: shows the refine step's reply while it streams in
+    refine_area = st.empty()
     with col1:
         rough_prompt = st.text_area(
             "Enter Your Rough Prompt Idea",
@@ -81,14 +214,17 @@ def main():
         )
     with col2:
         st.markdown('<div class="card">', unsafe_allow_html=True)
+        force_rerun = st.checkbox("Force rerun", key="force_rerun", help="Ignore cached results and call the model again.")
         if st.button("Run Studio", key="run_button", help="Generate, test, score, refine, and document prompts"):
             if not rough_prompt:
                 st.error("Please enter a rough prompt idea.")
             else:
                 with st.spinner("Running PromptStudio..."):
                     try:
-                        # Run the full PromptStudio pipeline
-                        results = pe.run_studio(rough_prompt, creativity_level, model_choice, test_iterations)
+                        # Run the full PromptStudio pipeline, reusing cached results unless forced
+                        results = cached_run_studio(
+                            rough_prompt, creativity_level, model_choice, test_iterations, refine_area, fresh=force_rerun
+                        )
                         logger.info(f"PromptStudio completed: {len(results['prompts'])} prompts processed")
 
                         # Store results in session state
@@ -100,40 +236,7 @@ def main():
                         st.error(f"Error running PromptStudio: {str(e)}")
 
     # Display results
-    if 'results' in st.session_state and st.session_state['results']:
-        results = st.session_state['results']
-
-        # Generated Prompts
-        st.markdown('<h2 class="sub-header">Generated Prompts</h2>', unsafe_allow_html=True)
-        for prompt_data in results['prompts']:
-            st.markdown(f'<h3>Prompt {prompt_data["id"]} ({prompt_data["style"]})</h3>', unsafe_allow_html=True)
-            st.markdown('<div class="result-box">', unsafe_allow_html=True)
-            st.write(prompt_data["prompt"])
-            st.markdown('</div>', unsafe_allow_html=True)
-
-        # Test Results and Scores
-        st.markdown('<h2 class="sub-header">Test Results and Scores</h2>', unsafe_allow_html=True)
-        for prompt_data in results['prompts']:
-            st.markdown(f'<h3>Prompt {prompt_data["id"]} ({prompt_data["style"]}) - Score: {prompt_data["score"]}/100</h3>', unsafe_allow_html=True)
-            st.markdown('<div class="result-box">', unsafe_allow_html=True)
-            st.write(f"Test Output:\n{prompt_data['output']}")
-            st.markdown('</div>', unsafe_allow_html=True)
-
-        # Refined Prompt
-        st.markdown('<h2 class="sub-header">Refined Prompt</h2>', unsafe_allow_html=True)
-        st.markdown('<div class="result-box">', unsafe_allow_html=True)
-        st.write(results['refined_prompt'])
-        st.markdown('</div>', unsafe_allow_html=True)
-
-        # Download Report
-        report_text = results['report']
-        st.download_button(
-            label="Download Report",
-            data=report_text,
-            file_name=f"promptstudio_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-            mime="text/plain",
-            key="download_button"
-        )
+    render_results()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,5 +1,13 @@
+import asyncio
+import copy
+import hashlib
+import itertools
+import json
 import logging
-from typing import Any, Dict
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional
 import requests
 import os
 from dotenv import load_dotenv
@@ -7,17 +15,27 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging is configured by the application (app.py)
 logger = logging.getLogger(__name__)
 
+# SQLite file backing the completion cache
+CACHE_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".promptstudio_cache.sqlite")
+
+# Completion cache bounds: in-memory LRU entries and rows kept in SQLite
+CACHE_MAX_MEMORY_ENTRIES = 512
+CACHE_MAX_DB_ENTRIES = 10000
+
+# Writes between checks of the SQLite row count against CACHE_MAX_DB_ENTRIES
+CACHE_TRIM_INTERVAL = 100
+
 # OpenRouter model configuration
 MODEL_CONFIG = {
     "meta-llama/llama-3.1-8b-instruct:free": {
         "provider": "openrouter",
         "api_key": os.getenv("OPENROUTER_API_KEY", "YOUR_OPENROUTER_API_KEY"),
         "endpoint": "https://openrouter.ai/api/v1/chat/completions",
-        "max_tokens": 2048
+        "max_tokens": 2048,
+        "batch_endpoint": None  # OpenAI-compatible base URL exposing /files and /batches, if any
     }
 }
 
@@ -31,21 +49,35 @@ class OpenRouterClient:
             "HTTP-Referer": "http://localhost:8501",
             "X-Title": "PromptStudio"
         }
+        # requests.Session is not documented as thread-safe, so each worker thread
+        # gets its own session (and keep-alive connection pool), reused across calls
+        self._local = threading.local()
         logger.info(f"Initialized OpenRouter client with API key: {config['api_key'][:8]}...")
 
-    def complete(self, prompt: str) -> str:
-        """Sends a prompt to OpenRouter and returns the response."""
+    @property
+    def session(self) -> requests.Session:
+        """Returns this thread's session, creating it on first use."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self._local.session = session
+        return session
+
+    def complete(self, prompt: str, response_format: Optional[Dict] = None, max_tokens: Optional[int] = None) -> str:
+        """Sends a prompt to OpenRouter and returns the response, optionally requesting structured output or another token limit."""
         payload = {
             "model": "meta-llama/llama-3.1-8b-instruct:free",
             "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": self.config["max_tokens"]
+            "max_tokens": max_tokens or self.config["max_tokens"]
         }
+        if response_format:
+            payload["response_format"] = response_format
         try:
             logger.info(f"Sending request to OpenRouter: {payload['model']}")
-            response = requests.post(
+            response = self.session.post(
                 self.config["endpoint"],
                 json=payload,
-                headers=self.headers,
                 timeout=30
             )
             response.raise_for_status()
@@ -61,6 +93,214 @@ class OpenRouterClient:
             logger.error(f"OpenRouter API error: {str(e)}")
             raise
 
+    async def acomplete(self, prompt: str, sample: int = 0) -> str:
+        """Runs `complete` in a worker thread so concurrent requests overlap; `sample` is unused here."""
+        return await asyncio.to_thread(self.complete, prompt)
+
+    def stream_complete(self, prompt: str) -> Iterator[str]:
+        """Sends a prompt to OpenRouter and yields the response text as it streams in (SSE)."""
+        payload = {
+            "model": "meta-llama/llama-3.1-8b-instruct:free",
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.config["max_tokens"],
+            "stream": True
+        }
+        try:
+            logger.info(f"Streaming request to OpenRouter: {payload['model']}")
+            with self.session.post(self.config["endpoint"], json=payload, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    # Skip keep-alive comments and blank lines between events
+                    if not line or not line.startswith("data: "):
+                        continue
+                    data = line[len("data: "):]
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)["choices"][0]["delta"].get("content")
+                    if chunk:
+                        yield chunk
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"OpenRouter API error: {str(e)}")
+            if response.status_code == 401:
+                raise Exception("Unauthorized: Invalid or missing OpenRouter API key. Check your `.env` file.")
+            raise
+        except Exception as e:
+            logger.error(f"OpenRouter API error: {str(e)}")
+            raise
+
+def _is_json_object(text: str) -> bool:
+    """Checks whether text holds a JSON object, ignoring anything (e.g. code fences) around its outer braces."""
+    # Same span prompt_engine's generation parser decodes
+    try:
+        return isinstance(json.loads(text[text.find("{"):text.rfind("}") + 1]), dict)
+    except ValueError:
+        return False
+
+class CachingClient:
+    """Wraps a model client with a content-hash LRU completion cache persisted to SQLite."""
+    def __init__(self, inner: Any, model: str, db_path: str = CACHE_DB_PATH):
+        self.inner = inner
+        self.model = model
+        self.refresh = False
+        self.cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = itertools.count(1)  # shared with refreshing() views
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+        self._conn.commit()
+        logger.info(f"Initialized completion cache for {model} at {db_path}")
+
+    def refreshing(self) -> "CachingClient":
+        """Returns a view sharing this cache that skips lookups, so every call overwrites its entry."""
+        clone = copy.copy(self)
+        clone.refresh = True
+        return clone
+
+    def _key(self, prompt: str, response_format: Optional[Dict], sample: int, max_tokens: Optional[int] = None) -> str:
+        """Hashes everything that determines a completion into a cache key."""
+        raw = json.dumps([self.model, prompt, response_format, sample, max_tokens], sort_keys=True)
+        return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+    def _get(self, key: str) -> Optional[str]:
+        """Looks a key up in memory, then in SQLite."""
+        if self.refresh:
+            return None
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            else:
+                row = self._conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self._remember(key, row[0])
+            result = self.cache.get(key)
+        if result is not None and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Completion cache hit: %s", key)
+        return result
+
+    def _remember(self, key: str, result: str) -> None:
+        """Adds an entry to the in-memory LRU, evicting the least recently used one when full."""
+        self.cache[key] = result
+        self.cache.move_to_end(key)
+        if len(self.cache) > CACHE_MAX_MEMORY_ENTRIES:
+            self.cache.popitem(last=False)
+
+    def _put(self, key: str, result: str) -> None:
+        """Stores a completion in memory and in SQLite, periodically dropping the oldest DB rows over the cap."""
+        with self._lock:
+            self._remember(key, result)
+            # REPLACE assigns a new rowid, so rowid order is write order
+            self._conn.execute("INSERT OR REPLACE INTO completions (key, response) VALUES (?, ?)", (key, result))
+            if next(self._writes) % CACHE_TRIM_INTERVAL == 0:
+                excess = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0] - CACHE_MAX_DB_ENTRIES
+                if excess > 0:
+                    self._conn.execute(
+                        "DELETE FROM completions WHERE rowid IN (SELECT rowid FROM completions ORDER BY rowid LIMIT ?)",
+                        (excess,)
+                    )
+            self._conn.commit()
+
+    def complete(
+        self,
+        prompt: str,
+        response_format: Optional[Dict] = None,
+        sample: int = 0,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """Returns the cached completion for this prompt, calling the wrapped client on a miss.
+
+        Structured-output replies are only stored if they decode to a JSON object, so
+        truncated or malformed generations are retried on the next call.
+        """
+        key = self._key(prompt, response_format, sample, max_tokens)
+        result = self._get(key)
+        if result is None:
+            result = self.inner.complete(prompt, response_format=response_format, max_tokens=max_tokens)
+            if response_format is None or _is_json_object(result):
+                self._put(key, result)
+            else:
+                logger.warning("Not caching structured-output reply that is not valid JSON")
+        return result
+
+    async def acomplete(self, prompt: str, sample: int = 0) -> str:
+        """Runs `complete` in a worker thread so concurrent requests overlap."""
+        return await asyncio.to_thread(self.complete, prompt, None, sample)
+
+    def stream_complete(self, prompt: str, sample: int = 0) -> Iterator[str]:
+        """Yields a cached completion whole, or streams from the wrapped client and caches the result."""
+        key = self._key(prompt, None, sample)
+        cached = self._get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        for chunk in self.inner.stream_complete(prompt):
+            chunks.append(chunk)
+            yield chunk
+        self._put(key, "".join(chunks))
+
+class BatchClient:
+    """Client for OpenAI-compatible Batch APIs (files + batches endpoints)."""
+    def __init__(self, model: str, config: Dict):
+        self.model = model
+        self.config = config
+        self.base_url = config["batch_endpoint"].rstrip("/")
+        self.headers = {"Authorization": f"Bearer {config['api_key']}"}
+        logger.info(f"Initialized batch client for {model} at {self.base_url}")
+
+    def request_body(self, prompt: str) -> Dict:
+        """Builds the chat completion body for a single batch request line."""
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.config["max_tokens"]
+        }
+
+    def create_file(self, jsonl: str) -> str:
+        """Uploads a JSONL batch input file and returns its file ID."""
+        response = requests.post(
+            f"{self.base_url}/files",
+            headers=self.headers,
+            data={"purpose": "batch"},
+            files={"file": ("batch_input.jsonl", jsonl.encode("utf-8"))},
+            timeout=60
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def create_batch(self, input_file_id: str) -> Dict:
+        """Creates a chat completions batch job for an uploaded input file."""
+        response = requests.post(
+            f"{self.base_url}/batches",
+            headers=self.headers,
+            json={
+                "input_file_id": input_file_id,
+                "endpoint": "/v1/chat/completions",
+                "completion_window": "24h"
+            },
+            timeout=30
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def retrieve_batch(self, batch_id: str) -> Dict:
+        """Fetches the current state of a batch job."""
+        response = requests.get(f"{self.base_url}/batches/{batch_id}", headers=self.headers, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def cancel_batch(self, batch_id: str) -> Dict:
+        """Cancels a batch job that is still running."""
+        response = requests.post(f"{self.base_url}/batches/{batch_id}/cancel", headers=self.headers, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def file_content(self, file_id: str) -> str:
+        """Downloads the content of a batch output file."""
+        response = requests.get(f"{self.base_url}/files/{file_id}/content", headers=self.headers, timeout=60)
+        response.raise_for_status()
+        return response.text
+
 def get_model_client(model: str) -> Any:
     """
     Retrieves the client for the specified OpenRouter model.
@@ -82,6 +322,28 @@ def get_model_client(model: str) -> Any:
     config = MODEL_CONFIG[model]
     return OpenRouterClient(config)
 
+def get_batch_client(model: str) -> Optional[BatchClient]:
+    """
+    Retrieves a Batch API client for the specified model, if its provider supports one.
+    
+    Args:
+        model: The model name (e.g., 'meta-llama/llama-3.1-8b-instruct:free').
+    
+    Returns:
+        A BatchClient instance, or None if the model has no batch endpoint configured.
+    
+    Raises:
+        ValueError: If the model is not supported.
+    """
+    if model not in MODEL_CONFIG:
+        logger.error(f"Unsupported model: {model}")
+        raise ValueError(f"Model {model} is not supported.")
+
+    config = MODEL_CONFIG[model]
+    if not config.get("batch_endpoint"):
+        return None
+    return BatchClient(model, config)
+
 def validate_api_keys() -> bool:
     """
     Validates the OpenRouter API key by making a test request.
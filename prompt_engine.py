@@ -1,69 +1,201 @@
+import asyncio
+import json
 import logging
-from typing import List, Dict
+from typing import Any, Callable, Iterator, List, Dict, FrozenSet, Optional, Union
 import models_config as mc
 import re
+import time
 from datetime import datetime
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging is configured by the application (app.py)
 logger = logging.getLogger(__name__)
 
 # Define dynamic prompt styles
 PROMPT_STYLES = ["Concise", "Detailed", "Structured", "Creative"]
 
-def generate_prompts(rough_prompt: str, creativity_level: int) -> List[Dict]:
+# Creativity level (1-10) to the modifier used in the generation meta-prompt
+CREATIVITY_MODIFIERS = {
+    **dict.fromkeys(range(1, 5), "clear and straightforward"),
+    **dict.fromkeys(range(5, 8), "moderately creative"),
+    **dict.fromkeys(range(8, 11), "highly creative and innovative"),
+}
+
+# Maximum in-flight test requests (OpenRouter allows ~500 requests per minute)
+MAX_CONCURRENT_REQUESTS = 500 // 60
+
+# Seconds between status checks while waiting on a Batch API job
+BATCH_POLL_INTERVAL = 10
+
+# Seconds to wait for a Batch API job before falling back to concurrent requests
+BATCH_MAX_WAIT = 300
+
+# Completion budget for the generation call: four prompts plus a 100-200 word
+# sample output for each, wrapped in JSON, overflow the default 2048 tokens
+GENERATION_MAX_TOKENS = 4096
+
+# Maximum characters kept per test iteration in stored and displayed outputs
+MAX_ITER_CHARS = 2000
+
+# Precompiled patterns used when scoring and refining prompts
+_RE_SENT = re.compile(r'[.!?]')
+_RE_BAD = re.compile(r'\b(?:lorem|ipsum|error)\b')
+_RE_WORD = re.compile(r'\w+')
+_RE_AUDIENCE = re.compile(r'\b(?:tone|style|audience)\b')
+
+# JSON schema for generating every prompt version and a sample output in one call
+_PROMPTS_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "prompt_versions",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "prompts": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "style": {"type": "string", "enum": PROMPT_STYLES},
+                            "prompt": {"type": "string"},
+                            "sample_output": {"type": "string"}
+                        },
+                        "required": ["style", "prompt", "sample_output"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["prompts"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Matches a labeled style section in non-JSON generation responses: a line such as
+# "- Concise:" or "2. **Detailed**:", or a bold "**Detailed**:" label anywhere
+_STYLE_NAMES = '|'.join(map(re.escape, PROMPT_STYLES))
+_STYLE_SPLIT = re.compile(
+    r'(?:^[ \t]*(?:[-*]|\d+\.)?[ \t]*(?:\*\*)?(?P<line>' + _STYLE_NAMES + r')(?:\*\*)?'
+    r'|(?:\d+\.\s*)?\*\*(?P<bold>' + _STYLE_NAMES + r')\*\*)[ \t]*:',
+    re.MULTILINE
+)
+
+# Locate the items of a truncated {"prompts": [...]} generation response
+_RE_PROMPTS_ARRAY = re.compile(r'"prompts"\s*:\s*\[')
+_RE_ITEM_SEP = re.compile(r'[\s,]*')
+
+def _decode_prompt_items(response: str) -> Any:
+    """Returns the "prompts" value of a JSON response, or the complete items of a truncated one."""
+    start_idx, end_idx = response.find("{"), response.rfind("}")
+    try:
+        data = json.loads(response[start_idx:end_idx + 1])
+        return data.get("prompts") if isinstance(data, dict) else None
+    except ValueError:
+        pass
+
+    # Output cut off at max_tokens: decode the items that did arrive in full
+    match = _RE_PROMPTS_ARRAY.search(response)
+    if not match:
+        return None
+    decoder = json.JSONDecoder()
+    items = []
+    idx = match.end()
+    while True:
+        idx = _RE_ITEM_SEP.match(response, idx).end()
+        try:
+            item, idx = decoder.raw_decode(response, idx)
+        except ValueError:
+            return items
+        items.append(item)
+
+def _parse_json_prompts(response: str) -> Optional[Dict[str, tuple]]:
+    """Parses a structured generation response into {style: (prompt, sample_output)}, or None if it has no usable prompts."""
+    items = _decode_prompt_items(response)
+    if not isinstance(items, list):
+        return None
+
+    sections = {}
+    for item in items:
+        if isinstance(item, dict) and item.get("style") in PROMPT_STYLES:
+            prompt_text = str(item.get("prompt") or "").strip()
+            sections.setdefault(item["style"], (prompt_text, str(item.get("sample_output") or "").strip()))
+    return sections or None
+
+def _parse_labeled_prompts(response: str) -> Dict[str, tuple]:
+    """Parses a "- Style: ..." or "**Style**: ..." labeled response into {style: (prompt, None)}."""
+    matches = list(_STYLE_SPLIT.finditer(response))
+    sections = {}
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        end_idx = next_match.start() if next_match else len(response)
+        style = match.group('line') or match.group('bold')
+        sections.setdefault(style, (response[match.end():end_idx].strip(), None))
+    return sections
+
+def creativity_modifier(creativity_level: int) -> str:
+    """Maps a creativity level to its meta-prompt modifier; out-of-range levels are clamped to 1-10."""
+    return CREATIVITY_MODIFIERS[min(max(creativity_level, 1), 10)]
+
+def generate_prompts(rough_prompt: str, creativity_level: int, client: Optional[Any] = None) -> List[Dict]:
     """
     Generates multiple prompt versions from a rough prompt idea.
     
     Args:
         rough_prompt: The rough prompt idea.
         creativity_level: Creativity level (1-10) to adjust novelty.
+        client: Optional model client to reuse; defaults to the first configured model.
     
     Returns:
-        A list of dictionaries with prompt IDs, styles, and texts.
+        A list of dictionaries with prompt IDs, styles, texts, and (when the
+        model returned structured output) a sample output for each prompt.
+        Prompts that could not be parsed carry an 'error' flag.
     """
     logger.info(f"Generating prompts for: {rough_prompt}, creativity: {creativity_level}")
     
-    creativity_modifier = "highly creative and innovative" if creativity_level > 7 else "moderately creative" if creativity_level > 4 else "clear and straightforward"
+    modifier = creativity_modifier(creativity_level)
     meta_prompt = f"""
-You are an expert prompt engineering team tasked with creating 4 professional prompt versions for the rough prompt idea '{rough_prompt}'. Each prompt must have a distinct style: Concise, Detailed, Structured, and Creative. Ensure the prompts are {creativity_modifier}, relevant to the topic, and optimized for clarity and effectiveness. Return the prompts in the following format, with each prompt labeled:
-
-1. **Concise**: A short, direct prompt (50-100 words).
-2. **Detailed**: A comprehensive prompt (150-200 words) with specific instructions.
-3. **Structured**: A prompt (100-150 words) using bullet points or numbered steps.
-4. **Creative**: A novel, engaging prompt (100-150 words) with a unique angle.
-
-Example for rough prompt 'Write a blog about AI trends':
-1. **Concise**: Write a 500-word blog on key AI trends in 2025, focusing on industry impacts.
-2. **Detailed**: Write a 1000-word blog exploring AI trends in 2025, including case studies, data, and predictions, in a professional tone for tech executives.
-3. **Structured**: Write a 750-word blog on AI trends, covering:
-   - Current advancements
-   - Industry applications
-   - Future outlook
-4. **Creative**: Craft a 600-word blog as a futuristic AI narrating 2025 trends, blending humor and insight.
+You are an expert prompt engineering team tasked with creating 4 professional prompt versions for the rough prompt idea '{rough_prompt}'. Each prompt must have a distinct style: Concise, Detailed, Structured, and Creative. Ensure the prompts are {modifier}, relevant to the topic, and optimized for clarity and effectiveness.
+
+- Concise: A short, direct prompt (50-100 words).
+- Detailed: A comprehensive prompt (150-200 words) with specific instructions.
+- Structured: A prompt (100-150 words) using bullet points or numbered steps.
+- Creative: A novel, engaging prompt (100-150 words) with a unique angle.
+
+For each prompt, also write "sample_output": the response (100-200 words) a capable assistant would give to that prompt on its own.
+
+Return only a JSON object of the form:
+{{"prompts": [{{"style": "Concise", "prompt": "...", "sample_output": "..."}}, ...]}}
+
+Example prompts for rough prompt 'Write a blog about AI trends':
+- Concise: Write a 500-word blog on key AI trends in 2025, focusing on industry impacts.
+- Detailed: Write a 1000-word blog exploring AI trends in 2025, including case studies, data, and predictions, in a professional tone for tech executives.
+- Structured: Write a 750-word blog on AI trends, covering: 1. Current advancements 2. Industry applications 3. Future outlook
+- Creative: Craft a 600-word blog as a futuristic AI narrating 2025 trends, blending humor and insight.
 
 Generate the 4 prompts for '{rough_prompt}'.
 """
     
     try:
-        client = mc.get_model_client(list(mc.MODEL_CONFIG.keys())[0])
-        response = client.complete(meta_prompt)
+        client = client or mc.get_model_client(list(mc.MODEL_CONFIG.keys())[0])
+        response = client.complete(meta_prompt, response_format=_PROMPTS_SCHEMA, max_tokens=GENERATION_MAX_TOKENS)
         logger.info(f"Received raw response: {response[:100]}...")
 
         # Parse response into structured prompts
+        sections = _parse_json_prompts(response)
+        if sections is None:
+            logger.warning("Response was not valid prompt JSON, falling back to labeled sections")
+            sections = _parse_labeled_prompts(response)
+
         prompts = []
         for idx, style in enumerate(PROMPT_STYLES, 1):
-            start_marker = f"**{style}**:"
-            end_marker = f"**{PROMPT_STYLES[(idx % len(PROMPT_STYLES))]}**:" if idx < len(PROMPT_STYLES) else None
-            start_idx = response.find(start_marker) + len(start_marker)
-            end_idx = response.find(end_marker) if end_marker else len(response)
-            prompt_text = response[start_idx:end_idx].strip()
-            
+            prompt_text, sample_output = sections.get(style, (None, None))
             if prompt_text:
-                prompts.append({"id": idx, "style": style, "prompt": prompt_text})
+                prompt_data = {"id": idx, "style": style, "prompt": prompt_text}
+                if sample_output:
+                    prompt_data['sample_output'] = sample_output
+                prompts.append(prompt_data)
             else:
                 logger.warning(f"Failed to parse prompt for {style}")
-                prompts.append({"id": idx, "style": style, "prompt": f"Error: Could not generate {style} prompt."})
+                prompts.append({"id": idx, "style": style, "prompt": f"Error: Could not generate {style} prompt.", "error": True})
 
         return prompts
 
@@ -71,96 +203,402 @@ Generate the 4 prompts for '{rough_prompt}'.
         logger.error(f"Error generating prompts: {str(e)}")
         raise
 
-def test_prompt(prompt: str, model: str, iterations: int) -> str:
+def _format_iterations(outputs: List[str], max_chars: Optional[int] = MAX_ITER_CHARS) -> str:
+    """Joins per-iteration outputs into the aggregated test output, truncating each to `max_chars`."""
+    return "\n".join(f"Iteration {i+1}: {output[:max_chars]}" for i, output in enumerate(outputs))
+
+async def _acomplete(client, prompt: str, semaphore: asyncio.Semaphore, sample: int) -> str:
+    """Sends a single completion request for one iteration, bounded by the shared semaphore."""
+    async with semaphore:
+        return await client.acomplete(prompt, sample=sample)
+
+async def _atest_outputs(
+    prompt: str,
+    iterations: int,
+    semaphore: asyncio.Semaphore,
+    client: Any,
+    first_output: Optional[str] = None
+) -> List[str]:
+    """Collects the raw output of every test iteration, requesting them concurrently."""
+    outputs = [first_output] if first_output else []
+    tasks = [_acomplete(client, prompt, semaphore, i) for i in range(len(outputs), iterations)]
+    outputs.extend(await asyncio.gather(*tasks))
+    return outputs
+
+async def atest_prompt(
+    prompt: str,
+    model: str,
+    iterations: int,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    client: Optional[Any] = None,
+    first_output: Optional[str] = None
+) -> str:
     """
-    Tests a prompt by sending it to the specified model.
+    Tests a prompt by sending all iterations to the specified model concurrently.
     
     Args:
         prompt: The prompt to test.
         model: The OpenRouter model.
         iterations: Number of test runs.
+        semaphore: Optional semaphore shared across prompts to cap concurrent requests.
+        client: Optional model client to reuse instead of building one for `model`.
+        first_output: Output already produced for this prompt (e.g., its sample_output);
+            used as the first iteration so only the remaining ones are requested.
     
     Returns:
         Aggregated test output.
     """
     logger.info(f"Testing prompt: {prompt[:50]}..., iterations: {iterations}")
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
     try:
-        client = mc.get_model_client(model)
-        outputs = []
-        for i in range(iterations):
-            output = client.complete(prompt)
-            outputs.append(f"Iteration {i+1}: {output}")
-        return "\n".join(outputs)
+        client = client or mc.get_model_client(model)
+        outputs = await _atest_outputs(prompt, iterations, semaphore, client, first_output)
+        return _format_iterations(outputs)
     except Exception as e:
         logger.error(f"Error testing prompt: {str(e)}")
         raise
 
-def score_output(output: str, prompt: str) -> int:
+def test_prompt(prompt: str, model: str, iterations: int, client: Optional[Any] = None) -> str:
+    """
+    Tests a prompt by sending it to the specified model.
+    
+    Args:
+        prompt: The prompt to test.
+        model: The OpenRouter model.
+        iterations: Number of test runs.
+        client: Optional model client to reuse instead of building one for `model`.
+    
+    Returns:
+        Aggregated test output.
+    """
+    return asyncio.run(atest_prompt(prompt, model, iterations, client=client))
+
+def _run_test_batch(client: Any, prompts: List[Dict], iterations: int) -> Dict[int, List[str]]:
+    """
+    Runs every remaining test iteration as one Batch API job and returns raw outputs by prompt ID.
+    
+    Raises if the job fails, misses any request, or does not finish within BATCH_MAX_WAIT seconds.
+    """
+    lines = [
+        json.dumps({
+            "custom_id": f"{prompt_data['id']}-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": client.request_body(prompt_data['prompt'])
+        })
+        for prompt_data in prompts
+        for i in range(1 if prompt_data.get('sample_output') else 0, iterations)
+    ]
+    logger.info(f"Submitting batch of {len(lines)} test requests")
+    results = {}
+    try:
+        if lines:
+            batch = client.create_batch(client.create_file("\n".join(lines)))
+            deadline = time.monotonic() + BATCH_MAX_WAIT
+            while batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+                if time.monotonic() >= deadline:
+                    client.cancel_batch(batch["id"])
+                    raise TimeoutError(f"Batch {batch['id']} did not finish within {BATCH_MAX_WAIT}s")
+                time.sleep(BATCH_POLL_INTERVAL)
+                batch = client.retrieve_batch(batch["id"])
+            if batch["status"] != "completed":
+                raise Exception(f"Batch {batch['id']} finished with status: {batch['status']}")
+
+            for line in client.file_content(batch["output_file_id"]).splitlines():
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") != 200:
+                    raise Exception(f"Batch request {record.get('custom_id')} failed: {record.get('error') or response.get('body')}")
+                results[record.get("custom_id")] = response["body"]["choices"][0]["message"]["content"]
+    except Exception as e:
+        logger.error(f"Error running test batch: {str(e)}")
+        raise
+
+    outputs = {}
+    for prompt_data in prompts:
+        outputs[prompt_data['id']] = [prompt_data['sample_output']] if prompt_data.get('sample_output') else []
+        for i in range(len(outputs[prompt_data['id']]), iterations):
+            custom_id = f"{prompt_data['id']}-{i}"
+            if custom_id not in results:
+                raise Exception(f"Batch output is missing request {custom_id}")
+            outputs[prompt_data['id']].append(results[custom_id])
+    return outputs
+
+async def batch_test_prompts(
+    prompts: List[Dict],
+    model: str,
+    iterations: int,
+    client: Optional[Any] = None,
+    use_batch: bool = True
+) -> List[Union[List[str], Exception]]:
+    """
+    Tests all prompts, as a single Batch API job when requested and the model supports one.
+    
+    Batch jobs can take minutes to hours, so they suit offline sweeps rather than
+    interactive runs. Falls back to sending every prompt's iterations concurrently
+    when `use_batch` is False, the model has no batch support, or the batch job
+    fails or times out.
+    
+    Args:
+        prompts: List of generated prompts. A prompt's 'sample_output', if present,
+            is used as its first iteration.
+        model: The model to test with.
+        iterations: Number of test runs per prompt.
+        client: Optional model client for the concurrent path; built from `model` if omitted.
+        use_batch: Whether to try the Batch API first.
+    
+    Returns:
+        For each prompt, in order, its raw per-iteration outputs or the exception that stopped its test.
+    """
+    batch_client = mc.get_batch_client(model) if use_batch else None
+    if batch_client is not None:
+        try:
+            outputs = await asyncio.to_thread(_run_test_batch, batch_client, prompts, iterations)
+            return [outputs[p['id']] for p in prompts]
+        except Exception as e:
+            logger.warning(f"Batch testing failed, testing prompts concurrently: {str(e)}")
+
+    client = client or mc.get_model_client(model)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return await asyncio.gather(
+        *[_atest_outputs(p['prompt'], iterations, semaphore, client, p.get('sample_output')) for p in prompts],
+        return_exceptions=True
+    )
+
+def keyword_set(text: str) -> FrozenSet[str]:
+    """
+    Tokenizes text into its set of lowercase keywords.
+    
+    Args:
+        text: The text to tokenize.
+    
+    Returns:
+        A frozenset of the distinct words in the text.
+    """
+    return frozenset(_RE_WORD.findall(text.lower()))
+
+def score_output(output: str, prompt_kwset: FrozenSet[str]) -> int:
     """
     Scores the output based on clarity, relevance, and length.
     
     Args:
         output: The model output.
-        prompt: The original prompt.
+        prompt_kwset: Keyword set of the original prompt, from keyword_set().
     
     Returns:
         A score from 0 to 100.
     """
     score = 0
+    output_lower = output.lower()
+    word_count = len(output.split())
     
     # Clarity (0-40): Check for coherence and readability
-    if len(output.split()) > 10 and len(re.findall(r'[.!?]', output)) > 1:
+    if word_count > 10 and len(_RE_SENT.findall(output)) > 1:
         score += 30
-    if not re.search(r'\b(lorem|ipsum|error)\b', output.lower()):
+    if not _RE_BAD.search(output_lower):
         score += 10
 
     # Relevance (0-40): Check if output aligns with prompt keywords
-    prompt_keywords = set(re.findall(r'\w+', prompt.lower()))
-    output_keywords = set(re.findall(r'\w+', output.lower()))
-    common_keywords = len(prompt_keywords.intersection(output_keywords))
-    if common_keywords / max(len(prompt_keywords), 1) > 0.5:
+    common_keywords = len(prompt_kwset.intersection(_RE_WORD.findall(output_lower)))
+    if common_keywords / max(len(prompt_kwset), 1) > 0.5:
         score += 30
     elif common_keywords > 0:
         score += 20
 
     # Length (0-20): Penalize overly short or long outputs
-    word_count = len(output.split())
     if 50 <= word_count <= 500:
         score += 20
     elif 20 <= word_count < 50 or 500 < word_count <= 1000:
         score += 10
 
-    logger.info(f"Scored output: {score}/100")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Scored output: %d/100", score)
     return min(score, 100)
 
-def refine_prompt(prompt: str, output: str, score: int) -> str:
+# Scorer installed by activate_numba_scorer(); None keeps score_outputs in pure Python
+_numba_scorer = None
+
+# Words that make _RE_BAD match, as whole \w tokens
+_BAD_WORDS = ("lorem", "ipsum", "error")
+
+def activate_numba_scorer() -> bool:
     """
-    Refines the highest-scoring prompt based on test output and score.
+    Compiles the numba scoring kernel and makes score_outputs use it.
     
-    Args:
-        prompt: The original prompt.
-        output: The test output.
-        score: The prompt's score.
+    The kernel tokenizes each lowercased output from its UTF-32 code points into
+    int32 word hashes and applies score_output's whole rubric in one pass, so no
+    per-output regex or set work is left in Python. Lookup tables reproduce the
+    `\\w` and str.split() character classes exactly; scores can differ from
+    score_output only on a 31-bit hash collision between words.
     
     Returns:
-        The refined prompt.
+        True if numba and numpy are installed and the kernel is active.
     """
-    logger.info(f"Refining prompt: {prompt[:50]}..., score: {score}")
+    global _numba_scorer
+    if _numba_scorer is not None:
+        return True
+    try:
+        import numba
+        import numpy as np
+    except ImportError:
+        logger.warning("numba/numpy not installed, score_outputs will use score_output")
+        return False
+
+    # Per-code-point character classes: \w is alphanumeric or "_", str.split() splits on isspace
+    chars = [chr(code) for code in range(0x110000)]
+    word_table = np.fromiter((ch.isalnum() or ch == '_' for ch in chars), dtype=np.bool_, count=len(chars))
+    space_table = np.fromiter((ch.isspace() for ch in chars), dtype=np.bool_, count=len(chars))
+
+    @numba.njit(cache=True)
+    def _tokenize(codes, word_table):
+        """Hashes every \\w run in a code point array into an unsorted int32 array."""
+        hashes = np.empty(codes.shape[0] // 2 + 1, dtype=np.int32)
+        count = 0
+        h = 0
+        in_word = False
+        for code in codes:
+            if word_table[code]:
+                h = (h * 31 + code) & 0x7FFFFFFF
+                in_word = True
+            elif in_word:
+                hashes[count] = h
+                count += 1
+                h = 0
+                in_word = False
+        if in_word:
+            hashes[count] = h
+            count += 1
+        return hashes[:count]
+
+    @numba.njit(cache=True)
+    def _score_kernel(codes, tokens, space_table, prompt_hashes, bad_hashes):
+        """Computes score_output's rubric for one lowercased output from its code points and _tokenize hashes."""
+        word_count = 0
+        sent_count = 0
+        in_word = False
+        for code in codes:
+            if space_table[code]:
+                in_word = False
+            else:
+                if not in_word:
+                    word_count += 1
+                in_word = True
+                if code == 46 or code == 33 or code == 63:  # . ! ?
+                    sent_count += 1
+        tokens = np.sort(tokens)
+
+        score = 0
+        if word_count > 10 and sent_count > 1:
+            score += 30
+        bad = False
+        for bad_hash in bad_hashes:
+            idx = np.searchsorted(tokens, bad_hash)
+            if idx < tokens.shape[0] and tokens[idx] == bad_hash:
+                bad = True
+        if not bad:
+            score += 10
+
+        # Count shared keywords by merging the sorted arrays, skipping repeated output tokens
+        common = 0
+        i = 0
+        j = 0
+        while i < tokens.shape[0] and j < prompt_hashes.shape[0]:
+            if tokens[i] == prompt_hashes[j]:
+                common += 1
+                i += 1
+                j += 1
+            elif tokens[i] < prompt_hashes[j]:
+                i += 1
+            else:
+                j += 1
+        if common / max(prompt_hashes.shape[0], 1) > 0.5:
+            score += 30
+        elif common > 0:
+            score += 20
+
+        if word_count >= 50 and word_count <= 500:
+            score += 20
+        elif (word_count >= 20 and word_count < 50) or (word_count > 500 and word_count <= 1000):
+            score += 10
+        return min(score, 100)
+
+    def _codes(text):
+        """Returns the code points of text as an int32 array."""
+        return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.int32)
+
+    def _score(output, prompt_hashes):
+        """Scores one output against a prompt's hashes from _prompt_hashes."""
+        codes = _codes(output.lower())
+        return _score_kernel(codes, _tokenize(codes, word_table), space_table, prompt_hashes, bad_hashes)
+
+    def _prompt_hashes(kwset):
+        """Hashes a keyword set into the sorted, unique array _score_kernel expects."""
+        return np.unique(_tokenize(_codes(' '.join(kwset)), word_table))
+
+    # Compile now so the first scoring call doesn't pay the JIT cost
+    bad_hashes = _prompt_hashes(_BAD_WORDS)
+    _score("warm up.", _prompt_hashes(["warm"]))
+    _numba_scorer = (_score, _prompt_hashes)
+    logger.info("Activated numba scoring kernel")
+    return True
+
+def score_outputs(outputs: List[str], prompt_kwsets: List[FrozenSet[str]]) -> List[int]:
+    """
+    Scores a batch of outputs, using the numba kernel if activate_numba_scorer() was called.
     
+    Args:
+        outputs: The model outputs.
+        prompt_kwsets: Keyword set of the prompt behind each output, from keyword_set().
+    
+    Returns:
+        A score from 0 to 100 for each output.
+    """
+    if _numba_scorer is None:
+        return [score_output(output, kwset) for output, kwset in zip(outputs, prompt_kwsets)]
+
+    _score, _prompt_hashes = _numba_scorer
+    prompt_hashes = {}
+    scores = []
+    for output, kwset in zip(outputs, prompt_kwsets):
+        if kwset not in prompt_hashes:
+            prompt_hashes[kwset] = _prompt_hashes(kwset)
+        scores.append(int(_score(output, prompt_hashes[kwset])))
+    logger.info(f"Scored {len(scores)} outputs")
+    return scores
+
+def _refine_meta_prompt(prompt: str, output: str, score: int) -> str:
+    """Builds the meta-prompt asking the model to refine a prompt given its test output and score."""
     refinements = []
     if score < 80:
         refinements.append("Add more specific instructions for clarity.")
     if len(output.split()) < 50:
         refinements.append("Increase the expected output length.")
-    if not re.search(r'\b(tone|style|audience)\b', prompt.lower()):
+    if not _RE_AUDIENCE.search(prompt.lower()):
         refinements.append("Specify tone and target audience.")
 
-    meta_prompt = f"""
+    return f"""
 You are an expert prompt engineer tasked with refining the following prompt to improve its clarity, specificity, and effectiveness. Original prompt: '{prompt}'. Test output: '{output[:200]}...'. Score: {score}/100. Suggested refinements: {', '.join(refinements) or 'None'}. Return the refined prompt.
 """
+
+def refine_prompt(prompt: str, output: str, score: int, client: Optional[Any] = None) -> str:
+    """
+    Refines the highest-scoring prompt based on test output and score.
+    
+    Args:
+        prompt: The original prompt.
+        output: The test output.
+        score: The prompt's score.
+        client: Optional model client to reuse; defaults to the first configured model.
+    
+    Returns:
+        The refined prompt.
+    """
+    logger.info(f"Refining prompt: {prompt[:50]}..., score: {score}")
+    meta_prompt = _refine_meta_prompt(prompt, output, score)
     
     try:
-        client = mc.get_model_client(list(mc.MODEL_CONFIG.keys())[0])
+        client = client or mc.get_model_client(list(mc.MODEL_CONFIG.keys())[0])
         refined_prompt = client.complete(meta_prompt)
         logger.info(f"Refined prompt: {refined_prompt[:50]}...")
         return refined_prompt.strip()
@@ -168,7 +606,25 @@ You are an expert prompt engineer tasked with refining the following prompt to i
         logger.error(f"Error refining prompt: {str(e)}")
         return prompt  # Fallback to original prompt
 
-def generate_report(rough_prompt: str, prompts: List[Dict], refined_prompt: str) -> str:
+def stream_refine_prompt(prompt: str, output: str, score: int, client: Optional[Any] = None) -> Iterator[str]:
+    """
+    Refines a prompt like refine_prompt, yielding the refined prompt as it streams in.
+    
+    Args:
+        prompt: The original prompt.
+        output: The test output.
+        score: The prompt's score.
+        client: Optional model client with stream_complete(); defaults to the first configured model.
+    
+    Yields:
+        Chunks of the refined prompt. Unlike refine_prompt, errors are raised
+        rather than replaced by the original prompt.
+    """
+    logger.info(f"Streaming refinement of prompt: {prompt[:50]}..., score: {score}")
+    client = client or mc.get_model_client(list(mc.MODEL_CONFIG.keys())[0])
+    yield from client.stream_complete(_refine_meta_prompt(prompt, output, score))
+
+def generate_report(rough_prompt: str, prompts: List[Dict], refined_prompt: str, best_score: Optional[int] = None) -> str:
     """
     Generates a detailed report of the PromptStudio process.
     
@@ -176,23 +632,29 @@ def generate_report(rough_prompt: str, prompts: List[Dict], refined_prompt: str)
         rough_prompt: The original rough prompt.
         prompts: List of generated prompts with test outputs and scores.
         refined_prompt: The refined prompt.
+        best_score: Highest prompt score, if already known; computed from prompts otherwise.
     
     Returns:
         The report text.
     """
     logger.info("Generating report...")
     
-    report = f"""
+    generated_at = datetime.now().isoformat()
+    styles = ', '.join(p['style'] for p in prompts)
+    if best_score is None:
+        best_score = max(p['score'] for p in prompts)
+
+    parts = [f"""
 PromptStudio Report
 ==================
-Generated: {datetime.now().isoformat()}
+Generated: {generated_at}
 Original Rough Prompt: {rough_prompt}
 
 1. Generated Prompts
 -------------------
-"""
+"""]
     for prompt_data in prompts:
-        report += f"""
+        parts.append(f"""
 Prompt {prompt_data['id']} ({prompt_data['style']}):
 {prompt_data['prompt']}
 
@@ -200,61 +662,143 @@ Test Output:
 {prompt_data['output'][:500]}...
 
 Score: {prompt_data['score']}/100
-"""
+""")
 
-    report += f"""
+    parts.append(f"""
 2. Refined Prompt
 ----------------
 {refined_prompt}
 
 3. Summary
 ----------
-Processed {len(prompts)} prompts with styles: {', '.join(p['style'] for p in prompts)}.
-Highest score: {max(p['score'] for p in prompts)}/100.
+Processed {len(prompts)} prompts with styles: {styles}.
+Highest score: {best_score}/100.
 Refinement improved the best prompt based on test feedback.
 ==================
-"""
+""")
     
-    return report
+    return "".join(parts)
 
-def run_studio(rough_prompt: str, creativity_level: int, model: str, iterations: int) -> Dict:
+async def evaluate_prompts(
+    rough_prompt: str,
+    creativity_level: int,
+    model: str,
+    iterations: int,
+    client: Optional[Any] = None,
+    generate: Callable[[str, int, Any], List[Dict]] = generate_prompts,
+    use_batch: bool = False
+) -> List[Dict]:
     """
-    Runs the full PromptStudio pipeline: generate, test, score, refine, document.
+    Runs the generate, test, and score steps of the pipeline.
     
     Args:
         rough_prompt: The rough prompt idea.
         creativity_level: Creativity level (1-10).
         model: The OpenRouter model.
         iterations: Number of test iterations.
+        client: Optional model client shared by every step; built once from `model` if omitted.
+        generate: Prompt generation step (e.g., a cached wrapper of generate_prompts).
+        use_batch: Test through the model's Batch API (offline sweeps); off for interactive runs.
     
     Returns:
-        A dictionary with prompts, refined prompt, and report.
+        The generated prompts with their test outputs and scores. Prompts that
+        failed to generate or test carry an 'error' flag.
     """
-    logger.info(f"Running PromptStudio for: {rough_prompt}")
-    
+    client = client or mc.get_model_client(model)
+
     # Generate prompts
-    prompts = generate_prompts(rough_prompt, creativity_level)
+    prompts = generate(rough_prompt, creativity_level, client)
+    kwsets = [keyword_set(prompt_data['prompt']) for prompt_data in prompts]
     
-    # Test and score prompts
-    for prompt_data in prompts:
-        try:
-            output = test_prompt(prompt_data['prompt'], model, iterations)
-            prompt_data['output'] = output
-            prompt_data['score'] = score_output(output, prompt_data['prompt'])
-        except Exception as e:
-            prompt_data['output'] = f"Error: {str(e)}"
+    # Test all prompts concurrently (or in one batch job when opted in);
+    # each prompt's sample output counts as its first iteration
+    outputs = await batch_test_prompts(prompts, model, iterations, client, use_batch=use_batch)
+
+    # Score the full outputs, but keep only truncated ones on the results
+    for prompt_data, kwset, output in zip(prompts, kwsets, outputs):
+        if isinstance(output, Exception):
+            prompt_data['output'] = f"Error: {str(output)}"
             prompt_data['score'] = 0
-            logger.error(f"Error testing prompt {prompt_data['id']}: {str(e)}")
+            prompt_data['error'] = True
+            logger.error(f"Error testing prompt {prompt_data['id']}: {str(output)}")
+        else:
+            prompt_data['output'] = _format_iterations(output)
+            prompt_data['score'] = score_output(_format_iterations(output, max_chars=None), kwset)
+    return prompts
 
-    # Refine the best prompt
-    best_prompt = max(prompts, key=lambda p: p['score'], default=prompts[0])
-    refined_prompt = refine_prompt(best_prompt['prompt'], best_prompt['output'], best_prompt['score'])
+def finish_studio(
+    rough_prompt: str,
+    prompts: List[Dict],
+    client: Optional[Any] = None,
+    refine: Callable[[str, str, int, Any], str] = refine_prompt
+) -> Dict:
+    """
+    Runs the refine and document steps of the pipeline on evaluated prompts.
+    
+    Args:
+        rough_prompt: The rough prompt idea.
+        prompts: Prompts with test outputs and scores, from evaluate_prompts().
+        client: Optional model client for the refine step.
+        refine: Prompt refinement step (e.g., one that streams refine_prompt's reply).
+    
+    Returns:
+        A dictionary with prompts, refined prompt, report, and a 'complete' flag
+        that is False if generating, testing, or refining any prompt failed.
+    """
+    # Refine the best prompt, found in a single pass
+    best_prompt = prompts[0]
+    best_score = best_prompt['score']
+    for prompt_data in prompts[1:]:
+        if prompt_data['score'] > best_score:
+            best_prompt = prompt_data
+            best_score = prompt_data['score']
+    refined_prompt = refine(best_prompt['prompt'], best_prompt['output'], best_score, client)
 
     # Generate report
-    report = generate_report(rough_prompt, prompts, refined_prompt)
+    report = generate_report(rough_prompt, prompts, refined_prompt, best_score=best_score)
+
+    # refine_prompt falls back to the original prompt when the model call fails
+    complete = not any(p.get('error') for p in prompts) and refined_prompt != best_prompt['prompt']
 
     return {
         "prompts": prompts,
         "refined_prompt": refined_prompt,
-        "report": report
-    }
\ No newline at end of file
+        "report": report,
+        "complete": complete
+    }
+
+async def run_studio(
+    rough_prompt: str,
+    creativity_level: int,
+    model: str,
+    iterations: int,
+    client: Optional[Any] = None,
+    generate: Callable[[str, int, Any], List[Dict]] = generate_prompts,
+    refine: Callable[[str, str, int, Any], str] = refine_prompt,
+    use_batch: bool = False
+) -> Dict:
+    """
+    Runs the full PromptStudio pipeline: generate, test, score, refine, document.
+    
+    All prompt/iteration test requests are issued concurrently; call with
+    `asyncio.run(...)` from synchronous code.
+    
+    Args:
+        rough_prompt: The rough prompt idea.
+        creativity_level: Creativity level (1-10).
+        model: The OpenRouter model.
+        iterations: Number of test iterations.
+        client: Optional model client shared by every step; built once from `model` if omitted.
+        generate: Prompt generation step (e.g., a cached wrapper of generate_prompts).
+        refine: Prompt refinement step (e.g., a cached wrapper of refine_prompt).
+        use_batch: Test through the model's Batch API (offline sweeps); off for interactive runs.
+    
+    Returns:
+        A dictionary with prompts, refined prompt, report, and a 'complete' flag
+        that is False if generating, testing, or refining any prompt failed.
+    """
+    logger.info(f"Running PromptStudio for: {rough_prompt}")
+    
+    client = client or mc.get_model_client(model)
+    prompts = await evaluate_prompts(rough_prompt, creativity_level, model, iterations, client, generate, use_batch)
+    return finish_studio(rough_prompt, prompts, client, refine)